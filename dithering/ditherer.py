@@ -12,6 +12,18 @@ import sys                              # To exit the program, etc.
 import numpy as np                      # For matrix maths.
 from collections import deque           # double-ended queue -  to reduce pop O
 from collections import defaultdict     # to initialise empty dict
+import multiprocessing as mp            # To dither on several cores.
+from multiprocessing import shared_memory   # To share image buffers between processes.
+from multiprocessing.connection import wait     # To watch for worker processes ending.
+import time                             # To time serial vs parallel.
+import hashlib                          # To name cached palette tables.
+import tempfile                         # To write cache files atomically.
+
+# where generated threshold maps & palette tables are kept
+cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "ditherer")
+palette_bits = 5        # bits per channel of the palette lookup table (32^3 entries)
+palette_luts = {}       # palette lookup tables already built or loaded, by palette
+fixed_bits = 20         # fractional bits of the fixed-point (integer) mode, over the 0-1 range
 
 
 def open_image(img_file, debug):
@@ -32,102 +44,855 @@ def open_image(img_file, debug):
     return img
 
 
-def get_closest(pix, channels):
-    return np.round(pix * (channels - 1)) / (channels - 1)
+# dy, dx, fraction
+
+FS_diffusion_matrix = [
+    (0, 1, 7.0 / 16.0),
+    (1, -1, 3.0 / 16.0),
+    (1, 0, 5.0 / 16.0),
+    (1, 1, 1.0 / 16.0)
+]
+
+Atkinson_diffusion_matrix = [
+    (0, 1, 1.0 / 8.0),
+    (0, 2, 1.0 / 8.0),
+    (1, -1, 1.0 / 8.0),
+    (1, 0, 1.0 / 8.0),
+    (1, 1, 1.0 / 8.0),
+    (2, 0, 1.0 / 8.0)
+]
+
+Burkes_diffusion_matrix = [
+    (0, 1, 8.0 / 32.0),
+    (0, 2, 4.0 / 32.0),
+    (1, -2, 2.0 / 32.0),
+    (1, -1, 4.0 / 32.0),
+    (1, 0, 8.0 / 32.0),
+    (1, 1, 4.0 / 32.0),
+    (1, 2, 2.0 / 32.0)
+]
+
+Sierra_lite_diffusion_matrix = [
+    (0, 1, 2.0 / 4.0),
+    (1, -1, 1.0 / 4.0),
+    (1, 0, 1.0 / 4.0)
+]
+
+diffusion_matrices = {"FS": FS_diffusion_matrix, "Sl": Sierra_lite_diffusion_matrix,
+                      "At": Atkinson_diffusion_matrix, "Bu": Burkes_diffusion_matrix}
+
+
+def get_bayer_matrix(size):
+    """The size x size Bayer index matrix (size a power of 2), values 0 to size^2 - 1."""
+    if size < 1 or size & (size - 1):
+        raise ValueError(f"Bayer matrix size must be a power of 2, not {size}")
+    matrix = np.zeros((1, 1), dtype=int)
+    while matrix.shape[0] < size:
+        matrix = np.block([[4 * matrix, 4 * matrix + 2],
+                           [4 * matrix + 3, 4 * matrix + 1]])
+    return matrix
+
+
+def get_bayer_thresholds(size=4):
+    """Bayer threshold map, thresholds evenly spread over (0, 1)."""
+    return (get_bayer_matrix(size) + 0.5) / size ** 2
+
+
+def save_cache(cache_file, array):
+    """Save an array to the on-disk cache atomically.
+
+    It's written to a temporary file next to cache_file, then renamed over it,
+    so processes filling the cache at the same time never see a part-written file.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, temp_file = tempfile.mkstemp(suffix=".npy", dir=cache_dir)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, array)
+        os.replace(temp_file, cache_file)
+    except BaseException:
+        os.remove(temp_file)
+        raise
+
+
+def get_gaussian_kernel(size, sigma):
+    """Gaussian centred on (0, 0) of a size x size torus, so it wraps round the edges."""
+    d = np.minimum(np.arange(size), size - np.arange(size))
+    return np.exp(-(d[:, np.newaxis] ** 2 + d ** 2) / (2 * sigma ** 2))
+
+
+def void_and_cluster(size, seed=0, sigma=1.5):
+    """Blue noise ranks (0 to size^2 - 1) for a size x size map, by Ulichney's void-and-cluster.
+
+    The energy of a pattern (its gaussian-filtered density, on a torus) comes
+    from an FFT convolution. Adding or removing a pixel then adds or removes a
+    shifted kernel, rather than filtering the whole pattern again.
+    """
+    n = size * size
+    rng = np.random.default_rng(seed)
+    kernel = get_gaussian_kernel(size, sigma)
+
+    def shifted(p):
+        return np.roll(kernel, divmod(p, size), axis=(0, 1)).ravel()
+
+    def tightest_cluster(pattern, energy):
+        return np.argmax(np.where(pattern, energy, -np.inf))
+
+    def largest_void(pattern, energy):
+        return np.argmin(np.where(pattern, np.inf, energy))
+
+    # initial pattern: random 10% of pixels, then spread out by moving the tightest
+    # cluster into the largest void until that stops changing anything
+    pattern = np.zeros(n, dtype=bool)
+    pattern[rng.choice(n, max(1, n // 10), replace=False)] = True
+    energy = np.fft.irfft2(np.fft.rfft2(pattern.reshape(size, size)) * np.fft.rfft2(kernel), s=(size, size)).ravel()
+    while True:
+        cluster = tightest_cluster(pattern, energy)
+        pattern[cluster] = False
+        energy -= shifted(cluster)
+        void = largest_void(pattern, energy)
+        pattern[void] = True
+        energy += shifted(void)
+        if void == cluster:
+            break
+
+    ranks = np.zeros(n, dtype=np.int32)
+    ones = int(pattern.sum())
+
+    # rank the initial pixels, taking away the tightest cluster each time
+    removing, removing_energy = pattern.copy(), energy.copy()
+    for rank in range(ones - 1, -1, -1):
+        cluster = tightest_cluster(removing, removing_energy)
+        removing[cluster] = False
+        removing_energy -= shifted(cluster)
+        ranks[cluster] = rank
+
+    # then the rest, filling the largest void each time (past half full, this is
+    # the same as taking the tightest cluster of the gaps)
+    for rank in range(ones, n):
+        void = largest_void(pattern, energy)
+        pattern[void] = True
+        energy += shifted(void)
+        ranks[void] = rank
+
+    return ranks.reshape(size, size)
+
+
+def get_blue_noise(size, seed=0):
+    """Blue noise ranks for a size x size map, memory-mapped from the on-disk cache.
+
+    Generated (and cached) the first time each size & seed is asked for.
+    """
+    cache_file = os.path.join(cache_dir, f"blue_noise_{size}_{seed}.npy")
+    if not os.path.exists(cache_file):
+        save_cache(cache_file, void_and_cluster(size, seed))
+    return np.load(cache_file, mmap_mode='r')
+
+
+def get_blue_noise_thresholds(size=64):
+    """Blue noise threshold map, thresholds evenly spread over (0, 1)."""
+    return (get_blue_noise(size) + 0.5) / size ** 2
+
+
+# ordered (threshold map) algorithms, by name, given the map size
+threshold_maps = {"Ba": get_bayer_thresholds, "Bn": get_blue_noise_thresholds}
+
+
+def get_levels(channels):
+    """The quantized values (0-1) of each level, indexed by level (0 to channels - 1)."""
+    return [k / (channels - 1) for k in range(channels)]
+
+
+def load_palette(palette_file):
+    """Read a palette file: one colour per line, as hex (#rrggbb) or r,g,b."""
+    palette = []
+    with open(palette_file) as f:
+        for line in f:
+            line = line.split(';')[0].strip()       # allow ; comments
+            if not line:
+                continue
+            if ',' in line:
+                palette.append([int(v) for v in line.split(',')])
+            else:
+                palette.append([int(line.lstrip('#')[i:i + 2], 16) for i in (0, 2, 4)])
+    if not 1 < len(palette) <= 256:
+        raise ValueError(f"palette needs 2 to 256 colours, not {len(palette)}")
+    return np.array(palette, dtype=np.uint8)
+
+
+def get_palette_lut(palette):
+    """Lookup table from rgb (top palette_bits bits each) to the nearest palette colour's index.
+
+    Built once per palette (nearest colour to the centre of each bin), then
+    cached on disk and in memory.
+    """
+    key = hashlib.md5(palette.tobytes() + bytes([palette_bits])).hexdigest()
+    if key in palette_luts:
+        return palette_luts[key]
+
+    cache_file = os.path.join(cache_dir, f"palette_lut_{key}.npy")
+    if os.path.exists(cache_file):
+        lut = np.load(cache_file)
+    else:
+        bins = 1 << palette_bits
+        centres = (np.arange(bins) + 0.5) * (256 / bins)
+        grid = np.stack(np.meshgrid(centres, centres, centres, indexing='ij'), axis=-1).reshape(-1, 1, 3)
+        colours = palette.astype(float)
+        lut = np.empty(len(grid), dtype=np.uint8)
+        for i in range(0, len(grid), 4096):         # a chunk at a time, to keep memory down
+            distance = ((grid[i:i + 4096] - colours) ** 2).sum(axis=2)
+            lut[i:i + 4096] = distance.argmin(axis=1)
+        save_cache(cache_file, lut)
+
+    palette_luts[key] = lut
+    return lut
+
+
+def get_output_table(channels):
+    """The 8-bit output value of each level, as ditherer has always written them."""
+    return (255 * np.array(get_levels(channels))).astype(np.uint8)
+
+
+def get_output_image(indices, channels, indexed=False):
+    """The dithered image from its (h, w, 3) level indices.
+
+    indexed gives a palette ('P') image of the channels^3 colours, one byte a
+    pixel, straight from the indices (as long as they fit: channels^3 <= 256).
+    Otherwise rgb, looked up in the output table.
+    """
+    table = get_output_table(channels)
+    if not indexed or channels ** 3 > 256:
+        return Image.fromarray(table[indices])
+
+    # index of each colour in the channels^3 cube, r major (fits in a byte)
+    img = Image.fromarray((indices[..., 0] * channels + indices[..., 1]) * channels + indices[..., 2])
+    img.putpalette(np.stack(np.meshgrid(table, table, table, indexing='ij'), axis=-1).tobytes())
+    return img
 
 
-def ditherer(img, channels, algorithm):
+def get_palette_image(indices, palette, indexed=False):
+    """The image dithered to a palette, from its (h, w) palette indices: rgb or (indexed) 'P'."""
+    if not indexed:
+        return Image.fromarray(palette[indices])
 
-    # dy, dx, fraction
+    img = Image.fromarray(indices)
+    img.putpalette(palette.tobytes())
+    return img
 
-    FS_diffusion_matrix = [
-        (0, 1, 7.0 / 16.0),
-        (1, -1, 3.0 / 16.0),
-        (1, 0, 5.0 / 16.0),
-        (1, 1, 1.0 / 16.0)
-    ]
 
-    Atkinson_diffusion_matrix = [
-        (0, 1, 1.0 / 8.0),
-        (0, 2, 1.0 / 8.0),
-        (1, -1, 1.0 / 8.0),
-        (1, 0, 1.0 / 8.0),
-        (1, 1, 1.0 / 8.0),
-        (2, 0, 1.0 / 8.0)
-    ]
+def working_rows(rows, depth, diffusion_matrix):
+    """The rows error diffusion works on, from an iterable of rows, yielding (row, targets).
+
+    Each row holds width pixels of depth interleaved values (0-255), padded
+    either side so the error can always be added without bounds checks
+    (errors landing in the padding, or past the last row, are dropped). Only
+    the rows the diffusion matrix reaches are kept. targets is (row, offset,
+    fraction) for each tap that lands on a row.
+    """
 
-    Burkes_diffusion_matrix = [
-        (0, 1, 8.0 / 32.0),
-        (0, 2, 4.0 / 32.0),
-        (1, -2, 2.0 / 32.0),
-        (1, -1, 4.0 / 32.0),
-        (1, 0, 8.0 / 32.0),
-        (1, 1, 4.0 / 32.0),
-        (1, 2, 2.0 / 32.0)
-    ]
+    pad = max(abs(dx) for dy, dx, fraction in diffusion_matrix) * depth
+    reach = max(dy for dy, dx, fraction in diffusion_matrix)
+    taps = [(dy, dx * depth, fraction) for dy, dx, fraction in diffusion_matrix]
+    padding = [0.0] * pad
 
-    Sierra_lite_diffusion_matrix = [
-        (0, 1, 2.0 / 4.0),
-        (1, -1, 1.0 / 4.0),
-        (1, 0, 1.0 / 4.0)
-    ]
+    rows = iter(rows)
 
-    diffusion_matrices = {"FS": FS_diffusion_matrix, "Sl": Sierra_lite_diffusion_matrix,
-                         "At": Atkinson_diffusion_matrix, "Bu": Burkes_diffusion_matrix}
+    def next_row():
+        row = next(rows, None)
+        if row is None:
+            return None
+        return padding + np.asarray(row, dtype=float).ravel().tolist() + padding
 
+    live = deque(next_row() for _ in range(reach + 1))
+
+    while live[0] is not None:
+        yield live[0], [(live[dy], dx, fraction) for dy, dx, fraction in taps if live[dy] is not None]
+
+        live.popleft()
+        live.append(next_row())
+
+
+def diffuse_rows(rows, width, depth, channels, diffusion_matrix):
+    """Error diffusion over an iterable of rows, yielding each row's quantized level indices.
+
+    Quantizing goes through the level table, and the arithmetic is otherwise
+    exactly that of the original per-pixel loop, so the results are bit-identical.
+    """
+
+    pad = max(abs(dx) for dy, dx, fraction in diffusion_matrix) * depth
+    levels = get_levels(channels)
+    top = channels - 1
+    start, stop = pad, pad + width * depth
+
+    for current, targets in working_rows(rows, depth, diffusion_matrix):
+        indices = bytearray(width * depth)
+
+        for t in range(start, stop):
+            pix = current[t] / 255
+            k = round(pix * top)
+            err = pix - levels[k]
+            indices[t - start] = k
+            for row, dx, fraction in targets:
+                row[t + dx] += err * fraction
+
+        yield indices
+
+
+def diffuse_palette_rows(rows, width, palette, diffusion_matrix):
+    """Error diffusion to a palette over an iterable of rgb rows, yielding rows of palette indices.
+
+    The three channels are quantized together, to the nearest palette colour
+    found through the palette lookup table, and the error is kept on the
+    same 0-255 scale as the values.
+    """
+
+    lut = get_palette_lut(palette).tolist()
+    colours = palette.astype(float).tolist()
+    top = (1 << palette_bits) - 1
+    shift = 8 - palette_bits
+
+    # lookup table part of each value's bin, shifted into place, by its integer part.
+    # The error can push values past 0 or 255: past the end goes to the top bin,
+    # and the trailing zeros catch negative values (python indexes them from the end).
+    margin = 1024
+    bins = [min(top, v >> shift) for v in range(256 + margin)] + [0] * margin
+    red = [k << 2 * palette_bits for k in bins]
+    green = [k << palette_bits for k in bins]
+
+    def far_out(r, g, b):
+        # (values beyond the margin)
+        r, g, b = (min(top, max(0, int(v) >> shift)) for v in (r, g, b))
+        return lut[(r << 2 * palette_bits) | (g << palette_bits) | b]
+
+    pad = max(abs(dx) for dy, dx, fraction in diffusion_matrix) * 3
+    start, stop = pad, pad + width * 3
+
+    for current, targets in working_rows(rows, 3, diffusion_matrix):
+        indices = bytearray(width)
+
+        for t in range(start, stop, 3):
+            r, g, b = current[t], current[t + 1], current[t + 2]
+            try:
+                k = lut[red[int(r)] | green[int(g)] | bins[int(b)]]
+            except IndexError:
+                k = far_out(r, g, b)
+            pr, pg, pb = colours[k]
+            er, eg, eb = r - pr, g - pg, b - pb
+            indices[(t - start) // 3] = k
+            for row, dx, fraction in targets:
+                row[t + dx] += er * fraction
+                row[t + dx + 1] += eg * fraction
+                row[t + dx + 2] += eb * fraction
+
+        yield indices
+
+
+def get_shifts(fraction):
+    """A diffusion fraction as (n, m), with fraction = n / 2^m."""
+    m = 0
+    while fraction * (1 << m) != int(fraction * (1 << m)):
+        m += 1
+    return int(fraction * (1 << m)), m
+
+
+def fixed_point_channel(plane, channels, diffusion_matrix):
+    """Integer error diffusion of one (h, w) uint8 channel, returning its level indices.
+
+    int32 fixed point (fixed_bits over 0-1); fraction n / 2^m is * n >> m, and the
+    float path's error / 255 is * 257 >> 16. Runs as a wavefront (j + lag * i = step).
+    """
+    h, w = plane.shape
+    one = 1 << fixed_bits
+    top = channels - 1
+
+    pad = max(abs(dx) for dy, dx, fraction in diffusion_matrix)
+    reach = max(dy for dy, dx, fraction in diffusion_matrix)
+    lag = 1 + max(-dx // dy for dy, dx, fraction in diffusion_matrix if dy > 0)
+    row = w + 2 * pad
+    taps = []
+    for dy, dx, fraction in diffusion_matrix:
+        n, m = get_shifts(fraction)
+        taps.append((dy * row + dx, n * 257, m + 16, 1 << (m + 15)))
+
+    # fixed-point tables: input value, and each level
+    values = np.rint(np.arange(256) * one / 255).astype(np.int32)
+    levels = np.rint(np.arange(channels) * one / top).astype(np.int32)
+
+    # padded working buffer (the padding & rows past the end just soak up error)
+    work = np.zeros((h + reach, row), dtype=np.int32)
+    work[:h, pad:pad + w] = values[plane]
+    work = work.ravel()
+    indices = np.empty(h * w, dtype=np.uint8)
+
+    for step in range(w + lag * (h - 1)):
+        i = np.arange(max(0, -((w - 1 - step) // lag)), min(h - 1, step // lag) + 1)
+        j = step - lag * i
+        here = i * row + j + pad
+
+        v = work[here]
+        k = np.clip((v * top + (one >> 1)) >> fixed_bits, 0, top)
+        err = v - levels[k]
+        indices[i * w + j] = k
+        for offset, multiplier, shift, rounding in taps:
+            work[here + offset] += (err * multiplier + rounding) >> shift
+
+    return indices.reshape(h, w)
+
+
+def fixed_point_ditherer(img, channels, algorithm, indexed=False):
+    """Error diffusion in fixed-point integers, one channel at a time (4 bytes a pixel, not 24).
+
+    Each rounding is at most 2^-fixed_bits; once a level flips, the difference
+    spread is at most step x fraction / 255 per tap (step = 1 / (channels - 1)).
+    """
+    img_array = np.asarray(img)
     diffusion_matrix = diffusion_matrices.get(algorithm)
+    indices = np.stack([fixed_point_channel(img_array[..., c], channels, diffusion_matrix)
+                        for c in range(3)], axis=-1)
+    return get_output_image(indices, channels, indexed)
+
 
-    img_array = np.array(img, dtype=float)
+def ordered_ditherer(img, channels, thresholds, indexed=False):
+    """Ordered dithering: quantize every pixel against a tiled threshold map, in one go.
+
+    Same levels as error diffusion's rounding, which is the special case of every threshold 0.5.
+    """
+
+    img_array = np.asarray(img)
     h, w = img_array.shape[:2]
+    th, tw = thresholds.shape
+    tiled = np.tile(thresholds.astype(np.float32), (-(-h // th), -(-w // tw)))[:h, :w, np.newaxis]
+
+    indices = np.minimum(np.floor(img_array * np.float32((channels - 1) / 255) + tiled), channels - 1)
+
+    return get_output_image(indices.astype(np.uint8), channels, indexed)
+
+
+def ditherer(img, channels, algorithm, map_size=None, palette=None, fixed_point=False, indexed=False):
+
+    if algorithm in threshold_maps:
+        # ordered dithering, with a map_size x map_size threshold map (or the default size)
+        thresholds = threshold_maps[algorithm](map_size) if map_size else threshold_maps[algorithm]()
+        return ordered_ditherer(img, channels, thresholds, indexed)
+
+    if fixed_point and palette is None:
+        return fixed_point_ditherer(img, channels, algorithm, indexed)
+
+    diffusion_matrix = diffusion_matrices.get(algorithm)
+
+    img_array = np.asarray(img)
+    h, w = img_array.shape[:2]
+
+    if palette is not None:
+        # dither to the palette's colours instead of the channels^3 cube
+        indices = np.empty((h, w), dtype=np.uint8)
+        for i, row in enumerate(diffuse_palette_rows(img_array, w, palette, diffusion_matrix)):
+            indices[i] = np.frombuffer(row, dtype=np.uint8)
+        return get_palette_image(indices, palette, indexed)
+
+    indices = np.empty((h, w, 3), dtype=np.uint8)
+    for i, row in enumerate(diffuse_rows(img_array, w, 3, channels, diffusion_matrix)):
+        indices[i] = np.frombuffer(row, dtype=np.uint8).reshape(w, 3)
+
+    return get_output_image(indices, channels, indexed)
+
+
+def get_sources(diffusion_matrix):
+    """Where a pixel's error comes from, as (dy, dx, fraction) back to each source pixel.
+
+    Sorted into the order the serial loop adds them in (raster order of the
+    source pixels), so pulling the errors in gives bit-identical sums.
+    """
+    sources = [(dy, -dx, fraction) for dy, dx, fraction in diffusion_matrix]
+    return sorted(sources, key=lambda source: (-source[0], source[1]))
+
+
+def create_shared(shape, dtype):
+    """A numpy array in new shared memory, with the memory block to close & unlink."""
+    dtype = np.dtype(dtype)
+    block = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+    return np.ndarray(shape, dtype=dtype, buffer=block.buf), block
+
+
+def attach_shared(name, shape, dtype):
+    """A numpy array on existing shared memory, with the memory block to close."""
+    block = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=block.buf), block
+
+
+def wavefront_worker(names, h, w, depth, channels, algorithm, progress, rank, workers, chunk):
+    """Dither every workers-th row (from rank), pulling in errors from the rows above.
+
+    A row only goes ahead, a chunk of columns at a time, once the rows above
+    have got far enough along for every error it needs, so the rows move
+    across the image as a diagonal wavefront.
+    """
+    sources = get_sources(diffusion_matrices.get(algorithm))
+    pad = max(abs(dx) for dy, dx, fraction in sources)
+    reach = max(dy for dy, dx, fraction in sources)
+    # how far along each row above has to be, past the end of the chunk
+    ahead = {dy: max(dx for sy, dx, fraction in sources if sy == dy) for dy in range(1, reach + 1)
+             if any(sy == dy for sy, dx, fraction in sources)}
+    levels = get_levels(channels)
+    top = channels - 1
+
+    src, src_block = attach_shared(names[0], (h, w * depth), np.uint8)
+    err, err_block = attach_shared(names[1], (h, (w + 2 * pad) * depth), float)
+    out, out_block = attach_shared(names[2], (h, w * depth), np.uint8)
+
+    for i in range(rank, h, workers):
+        orig = src[i].astype(float).tolist()
+        row_err = [0.0] * ((w + 2 * pad) * depth)     # padded, like the shared rows
+        indices = bytearray(w * depth)
+
+        for j0 in range(0, w, chunk):
+            j1 = min(w, j0 + chunk)
+
+            # wait for the rows above, then take the (padded) stretch of their errors we need
+            taps = []
+            for dy, dx, fraction in sources:
+                if i - dy < 0:
+                    continue
+                if dy == 0:
+                    taps.append((row_err, dx * depth, fraction))
+                    continue
+                needed = min(w, j1 + ahead[dy])
+                while True:
+                    with progress.get_lock():
+                        if progress[i - dy] >= needed:
+                            break
+                    time.sleep(0.0001)
+                above = err[i - dy, j0 * depth:(j1 + 2 * pad) * depth].tolist()
+                taps.append((above, dx * depth - j0 * depth, fraction))
+
+            for t in range((j0 + pad) * depth, (j1 + pad) * depth):
+                v = orig[t - pad * depth]
+                for row, offset, fraction in taps:
+                    v += row[t + offset] * fraction
+                pix = v / 255
+                k = round(pix * top)
+                row_err[t] = pix - levels[k]
+                indices[t - pad * depth] = k
+
+            err[i, (j0 + pad) * depth:(j1 + pad) * depth] = row_err[(j0 + pad) * depth:(j1 + pad) * depth]
+            out[i, j0 * depth:j1 * depth] = np.frombuffer(indices, dtype=np.uint8)[j0 * depth:j1 * depth]
+            with progress.get_lock():
+                progress[i] = j1
+
+    for block in (src_block, err_block, out_block):
+        block.close()
+
+
+def run_workers(processes):
+    """Start the worker processes and wait for them all to finish.
+
+    If one fails (an exception, or killed), the rest are terminated rather than
+    left waiting forever on rows it will never finish, and RuntimeError is raised.
+    """
+    try:
+        for process in processes:
+            process.start()
+        running = {process.sentinel: process for process in processes}
+        while running:
+            for sentinel in wait(list(running)):
+                process = running.pop(sentinel)
+                process.join()
+                if process.exitcode:
+                    raise RuntimeError(f"a dithering worker failed (exit code {process.exitcode})")
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            if process.pid is not None:
+                process.join()
+
+
+def parallel_ditherer(img, channels, algorithm, workers=None, chunk=64, indexed=False):
+    """Same output as ditherer, with the rows spread over worker processes as a wavefront."""
+
+    workers = workers or os.cpu_count()
+    pad = max(abs(dx) for dy, dx, fraction in diffusion_matrices.get(algorithm))
+
+    img_array = np.asarray(img)
+    h, w = img_array.shape[:2]
+    depth = 3
+
+    src, src_block = create_shared((h, w * depth), np.uint8)
+    err, err_block = create_shared((h, (w + 2 * pad) * depth), float)
+    out, out_block = create_shared((h, w * depth), np.uint8)
+    src[:] = img_array.reshape(h, w * depth)
+    err[:] = 0.0
+    progress = mp.Array('q', h)
+
+    names = (src_block.name, err_block.name, out_block.name)
+    processes = [mp.Process(target=wavefront_worker,
+                            args=(names, h, w, depth, channels, algorithm, progress, rank, workers, chunk))
+                 for rank in range(workers)]
+    try:
+        run_workers(processes)
+        indices = out.reshape(h, w, depth).copy()
+    finally:
+        for block in (src_block, err_block, out_block):
+            block.close()
+            block.unlink()
+
+    return get_output_image(indices, channels, indexed)
+
+
+def channel_worker(names, h, w, channels, algorithm, c):
+    """Dither channel c of the shared image, writing its level indices to the shared output."""
+    src, src_block = attach_shared(names[0], (h, w, 3), np.uint8)
+    out, out_block = attach_shared(names[1], (h, w, 3), np.uint8)
+
+    rows = (src[i, :, c] for i in range(h))
+    for i, row in enumerate(diffuse_rows(rows, w, 1, channels, diffusion_matrices.get(algorithm))):
+        out[i, :, c] = np.frombuffer(row, dtype=np.uint8)
 
-    for i in range(h):
-        for j in range(w):
-            pix = img_array[i, j] / 255
-            pix_new = get_closest(pix, channels)
-            img_array[i, j] = pix_new
-            err = pix - pix_new
+    src_block.close()
+    out_block.close()
 
-            for dy, dx, fraction in diffusion_matrix:
-                y, x = i + dy, j + dx
-                if 0 <= y < h and 0 <= x < w:
-                    img_array[y, x] += err * fraction
 
-    return Image.fromarray((255 * img_array).astype(np.uint8))
+def channel_ditherer(img, channels, algorithm, indexed=False):
+    """Same output as ditherer, with R, G & B dithered at once in their own processes.
+
+    The channels never mix (each is quantized and diffused on its own), so
+    each process works on one channel of the image in shared memory.
+    """
+
+    img_array = np.asarray(img)
+    h, w = img_array.shape[:2]
+
+    src, src_block = create_shared((h, w, 3), np.uint8)
+    out, out_block = create_shared((h, w, 3), np.uint8)
+    src[:] = img_array
+
+    names = (src_block.name, out_block.name)
+    processes = [mp.Process(target=channel_worker, args=(names, h, w, channels, algorithm, c))
+                 for c in range(3)]
+    try:
+        run_workers(processes)
+        indices = out.copy()
+    finally:
+        for block in (src_block, out_block):
+            block.close()
+            block.unlink()
+
+    return get_output_image(indices, channels, indexed)
+
+
+def read_ppm_header(f):
+    """Width, height, maxval & data offset of a binary (P6) ppm file, or None if it isn't one."""
+    if f.read(2) != b"P6":
+        return None
+    fields = []
+    token = b""
+    while len(fields) < 3:
+        c = f.read(1)
+        if not c:
+            return None
+        if c == b"#":           # comment, to the end of the line
+            f.readline()
+            c = b"\n"
+        if c.isspace():
+            if token:
+                fields.append(int(token))
+                token = b""
+        else:
+            token += c
+    # the single whitespace after maxval has been read, so the data starts here
+    return fields[0], fields[1], fields[2], f.tell()
+
+
+def open_strips(img_file, strip_rows):
+    """The image's width, height, and a generator of its rgb rows a strip at a time.
+
+    Only 8-bit binary (P6) ppms are streamed: they are memory-mapped, so only
+    the strip being read is ever in memory. Anything else (png, jpeg, tiff...)
+    has to be decoded whole by PIL first, with a warning, so memory still
+    grows with the image; convert those to ppm first for huge images.
+    """
+    with open(img_file, 'rb') as f:
+        ppm = read_ppm_header(f)
+
+    if ppm and ppm[2] == 255:
+        w, h, maxval, header = ppm
+        pixels = np.memmap(img_file, dtype=np.uint8, mode='r', offset=header, shape=(h, w, 3))
+    else:
+        print(f"Warning: {img_file} isn't an 8-bit binary ppm, so it is decoded whole rather than streamed "
+              f"(convert it to ppm to keep memory down).", file=sys.stderr)
+        img = Image.open(img_file)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')    # (only copy again if it has to be converted)
+        pixels = np.asarray(img)
+        h, w = pixels.shape[:2]
+
+    def strips():
+        for y in range(0, h, strip_rows):
+            yield np.array(pixels[y:y + strip_rows])    # read in (copy) just this strip
+
+    return w, h, strips()
+
+
+def strip_ditherer(img_file, out_file, channels, algorithm, strip_rows=256, palette=None):
+    """Error diffusion that streams the image through in strips, for images too big for memory.
+
+    Only the rows the diffusion matrix reaches (carrying the error from one
+    strip into the next) are kept, and each output row is written to a
+    binary ppm as soon as it is done, so memory depends on the width and
+    strip size, not the height. The image is dithered at full size.
+    """
+    diffusion_matrix = diffusion_matrices.get(algorithm)
+    w, h, strips = open_strips(img_file, strip_rows)
+    rows = (row for strip in strips for row in strip)
+
+    if palette is not None:
+        indexed = diffuse_palette_rows(rows, w, palette, diffusion_matrix)
+        table = palette
+    else:
+        indexed = diffuse_rows(rows, w, 3, channels, diffusion_matrix)
+        table = get_output_table(channels)
+
+    with open(out_file, 'wb') as f:
+        f.write(b"P6\n%i %i\n255\n" % (w, h))
+        for row in indexed:
+            f.write(table[np.frombuffer(row, dtype=np.uint8)].tobytes())
+
+
+def variant_initialiser(name, shape):
+    """Attach a pool worker to the shared (read-only) input image."""
+    global variant_input, variant_block
+    variant_input, variant_block = attach_shared(name, shape, np.uint8)
+
+
+def variant_worker(task):
+    """Dither & save one variant of the shared input image, returning its file name & time taken."""
+    out_file, channels, algorithm, options, save_options = task
+    start = time.perf_counter()
+    ditherer(Image.fromarray(variant_input), channels, algorithm, **options).save(out_file, **save_options)
+    return out_file, time.perf_counter() - start
+
+
+def dither_variants(img, variants, workers=None, save_options=None, **options):
+    """Dither one image several ways over a process pool, saving each result.
+
+    variants is a list of (out_file, channels, algorithm). The image is put in
+    shared memory once, for the workers to read, rather than each decoding
+    (or being sent) its own copy. options go on to ditherer, save_options to
+    Image.save.
+    Returns (out_file, seconds) for each variant, in the order they finished.
+    """
+    img_array = np.asarray(img)
+    shared, block = create_shared(img_array.shape, np.uint8)
+    shared[:] = img_array
+
+    workers = workers or min(len(variants), os.cpu_count())
+    tasks = [(out_file, channels, algorithm, options, save_options or {})
+             for out_file, channels, algorithm in variants]
+    try:
+        with mp.Pool(workers, variant_initialiser, (block.name, img_array.shape)) as pool:
+            results = list(pool.imap_unordered(variant_worker, tasks))
+    finally:
+        block.close()
+        block.unlink()
+
+    return results
 
 
 def runner(args):
     """Main function to run all components."""
 
-    channels = 6  # number of channels per RGB
-    algorithm = "At"  # "FS", "At", "Sl", "Bu"
+    channels_list = args.channels  # numbers of channels per RGB
+    algorithms = args.algorithm  # "FS", "At", "Sl", "Bu" (error diffusion) or "Ba", "Bn" (ordered)
+    variants = [(algorithm, channels) for algorithm in algorithms for channels in channels_list]
 
     # get input arguments
     img_file = args.image_in
     debug = args.debug
-
-    # open (and preprocess) image file
-    img = open_image(img_file, debug)
+    palette = load_palette(args.palette) if args.palette else None
+    indexed = args.indexed
+    save_options = {"compress_level": args.compress_level}
 
     # get & make filenames
     fileName, fileExtension = os.path.splitext(img_file)
-    filename_new = f"{fileName}_dithered_{algorithm}.png"
+
+    def get_filename(algorithm, channels, extension="png"):
+        # the channels only need to go in the name if there's more than one
+        if len(channels_list) > 1:
+            return f"{fileName}_dithered_{algorithm}_{channels}.{extension}"
+        return f"{fileName}_dithered_{algorithm}.{extension}"
+
+    if args.strips:
+        # stream the full size image through in strips (no resizing), out to a ppm
+        for algorithm, channels in variants:
+            strip_ditherer(img_file, get_filename(algorithm, channels, "ppm"), channels, algorithm, args.strips,
+                           palette)
+        return
+
+    # open (and preprocess) image file
+    img = open_image(img_file, debug)
 
     # get dimensions of original image
     w, h = img.size
 
-    # get pixels from original image
-    img_pix = img.load()
-
     # adjust image size
     ar = w / h
     w_new, h_new = 1920, round(1920 / ar)
     img = img.resize((w_new, h_new), Image.Resampling.LANCZOS)  # Lanczos filter anti-aliasing
 
+    if len(variants) > 1:
+        # decoded & resized once, now dither every variant of it in parallel
+        start = time.perf_counter()
+        results = dither_variants(img, [(get_filename(a, c), c, a) for a, c in variants], args.workers or None,
+                                  save_options, map_size=args.map_size, palette=palette,
+                                  fixed_point=args.fixed_point, indexed=indexed)
+        if debug or args.compare:
+            for out_file, seconds in results:
+                print(f"{out_file}: {seconds:.2f} s")
+            print(f"{len(results)} variants: {time.perf_counter() - start:.2f} s")
+        return
+
+    algorithm, channels = variants[0]
+    filename_new = get_filename(algorithm, channels)
+
     # apply dithering
-    img_new = ditherer(img, channels, algorithm)
+    start = time.perf_counter()
+    if algorithm in threshold_maps:
+        img_new = ditherer(img, channels, algorithm, args.map_size, indexed=indexed)
+        mode = "ordered"
+    elif palette is not None:
+        img_new = ditherer(img, channels, algorithm, palette=palette, indexed=indexed)
+        mode = "palette"
+    elif args.fixed_point:
+        img_new = ditherer(img, channels, algorithm, fixed_point=True, indexed=indexed)
+        mode = "fixed point"
+    elif args.per_channel:
+        img_new = channel_ditherer(img, channels, algorithm, indexed)
+        mode = "per channel (3 processes)"
+    elif args.workers:
+        img_new = parallel_ditherer(img, channels, algorithm, args.workers, indexed=indexed)
+        mode = f"parallel ({args.workers} workers)"
+    else:
+        img_new = ditherer(img, channels, algorithm, indexed=indexed)
+        mode = "serial"
+    dither_time = time.perf_counter() - start
+    if debug or args.compare:
+        print(f"{mode}: {dither_time:.2f} s")
+
+    if args.compare and mode not in ("serial", "ordered", "palette"):
+        start = time.perf_counter()
+        img_serial = ditherer(img, channels, algorithm, indexed=indexed)
+        serial_time = time.perf_counter() - start
+        new_rgb, serial_rgb = np.asarray(img_new.convert("RGB")), np.asarray(img_serial.convert("RGB"))
+        different = np.any(new_rgb != serial_rgb, axis=-1).sum()
+        print(f"serial: {serial_time:.2f} s, speedup: {serial_time / dither_time:.2f}x, "
+              f"{'identical output' if not different else f'{different} pixels differ'}")
 
     # done...
-    img_new.save(filename_new.format(channels))
+    start = time.perf_counter()
+    img_new.save(filename_new, **save_options)
+    if debug:
+        print(f"saved {filename_new} ({img_new.mode}): {time.perf_counter() - start:.2f} s, "
+              f"{os.path.getsize(filename_new)} bytes")
 
 
 if __name__ == '__main__':
@@ -137,9 +902,46 @@ if __name__ == '__main__':
     # Add arguments:
     parser.add_argument('image_in', type=str, help='Image file to process.')  # Required
     parser.add_argument('--debug', action='store_true', help='Option to enable debug mode.')   # Optional
+    parser.add_argument('--algorithm', choices=sorted(diffusion_matrices) + sorted(threshold_maps), default=['At'],
+                        nargs='+', help='Error diffusion (FS, At, Sl, Bu) or ordered (Ba Bayer, Bn blue noise) '
+                                        'dithering. Several make several outputs.')   # Optional
+    parser.add_argument('--channels', type=int, default=[6], nargs='+',
+                        help='Number of levels per RGB channel. Several make several outputs.')   # Optional
+    parser.add_argument('--map-size', type=int,
+                        help='Size of the threshold map for ordered dithering (default 4 Bayer, 64 blue noise; '
+                             'a power of 2 for Bayer).')   # Optional
+    parser.add_argument('--palette', type=str,
+                        help='Palette file (a colour per line, #rrggbb or r,g,b) to dither to, with error diffusion.')   # Optional
+    parser.add_argument('--fixed-point', action='store_true',
+                        help='Error diffusion in fixed-point integers (much faster, very slightly different).')   # Optional
+    parser.add_argument('--strips', type=int, default=0,
+                        help='Stream the full size image through this many rows at a time (for huge images), '
+                             'writing a ppm. Only 8-bit binary ppm input is streamed; other formats are '
+                             'decoded whole first.')   # Optional
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Dither in parallel with this many processes (wavefront over the rows, or one '
+                             'variant each when there are several).')   # Optional
+    parser.add_argument('--per-channel', action='store_true',
+                        help='Dither R, G & B in parallel, one process each.')   # Optional
+    parser.add_argument('--indexed', action='store_true',
+                        help='Save a palette (P mode) png of the dithered colours, instead of rgb '
+                             '(needs channels^3 <= 256, or a --palette).')   # Optional
+    parser.add_argument('--compress-level', type=int, default=6, choices=range(10), metavar='0-9',
+                        help='PNG compression level: 0 fastest & biggest, 9 slowest & smallest.')   # Optional
+    parser.add_argument('--compare', action='store_true',
+                        help='With --workers, --per-channel or --fixed-point, also dither serially and report '
+                             'the speedup.')   # Optional
 
     # Parse:
     input_args = parser.parse_args()
+    ordered = any(algorithm in threshold_maps for algorithm in input_args.algorithm)
+    size = input_args.map_size
+    if size is not None and "Ba" in input_args.algorithm and (size < 1 or size & (size - 1)):
+        parser.error(f"--map-size for Bayer (Ba) dithering must be a power of 2, not {size}")
+    if input_args.palette and ordered:
+        parser.error("--palette needs error diffusion algorithms")
+    if input_args.strips and ordered:
+        parser.error("--strips needs error diffusion algorithms")
 
     # START RUNNING MAIN PROGRAM #
     runner(input_args)
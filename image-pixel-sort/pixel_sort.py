@@ -10,8 +10,11 @@ import os                               # For terminal actions.
 from PIL import Image                   # Python Image Library.
 import sys                              # To exit the program, etc.
 import numpy as np                      # For matrix maths.
-from collections import deque           # double-ended queue -  to reduce pop O
-from collections import defaultdict     # to initialise empty dict
+import multiprocessing as mp            # to sort the frames of a sweep in parallel
+from multiprocessing import shared_memory   # to share the image with the worker processes
+# the shape labelling engine (shared with image2ascii) lives at the top of the repo
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from shape_labels import label_shapes, label_sweep     # noqa: E402
 
 
 def open_image(image_file, debug):
@@ -33,39 +36,11 @@ def open_image(image_file, debug):
 
 
 def luminance(pix_rgb):
-    """Given a set of rgb values of a pixel, calculate brightness."""
+    """Given a set of rgb values of a pixel (or arrays of them), calculate brightness."""
     r, g, b = pix_rgb
     return 0.299 * r + 0.587 * g + 0.114 * b  # luminance formula
 
 
-def bfs_search(matrix, start, tol, visited):
-    """Breadth First Search algorithm."""
-
-    w, h = matrix.shape
-    queue = deque([start])
-    init_brightness = matrix[start]
-    group = []
-
-    directions = [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (1, 1), (-1, 1), (1, -1)]
-
-    while queue:
-        x, y = queue.popleft()
-
-        if visited[x, y]:
-            continue
-
-        visited[x, y] = True
-        group.append((x, y))
-
-        for dx, dy in directions:
-            nx, ny = x + dx, y + dy
-            if 0 <= nx < w and 0 <= ny < h and not visited[nx, ny]:
-                if abs(matrix[nx, ny] - init_brightness) <= tol:
-                    queue.append((nx, ny))
-
-    return group
-
-
 '''
 # Not using this now...
 def quick_sort(pixels):
@@ -85,28 +60,163 @@ def quick_sort(pixels):
 
 
 def find_shapes(matrix, args):
-    """Use the bfs pathfinder to get subsets of similar brightness."""
+    """Use the shape labelling to get subsets of similar brightness.
+
+    Returns the label matrix and the order the pixels were found in.
+    """
     tol = args.tolerance
     debug = args.debug
+    seed_relative = args.grouping == "seed"
     if debug:
         print("find_shapes")
-    # initialise shapes and bfs stuff
-    w, h = matrix.shape
-    shapes = []     # list
-    visited = np.zeros((w, h), dtype=bool)
-    # find shapes...
-    for x in range(w):
-        for y in range(h):
-            if not visited[x, y]:
-                shape = bfs_search(matrix, (x, y), tol, visited)
-                shapes.append(shape)
 
-    return shapes
+    return label_shapes(matrix, tol, seed_relative, return_order=True)
+
+
+def radix_argsort(keys, perm):
+    """Stable sort of the indices perm by integer keys (least significant key first).
+
+    Each key is sorted on 16 bits at a time, and numpy's stable sort of 16 bit
+    integers is a radix (counting) sort, so every pass is O(N).
+    """
+
+    for key in keys:
+        key = key.astype(np.int64)
+        for shift in range(0, max(int(key.max()), 1).bit_length(), 16):
+            digit = ((key >> shift) & 0xFFFF).astype(np.uint16)
+            perm = perm[np.argsort(digit[perm], kind='stable')]
+
+    return perm
+
+
+def sort_rows(labels, order, matrix, quantised=False):
+    """Sort the row segments of every shape by brightness, all in one go.
+
+    A row segment is a shape's pixels in one row, taken in the order they were
+    found. Returns flat (x*h + y) indices (pos, src): the sorted segments put
+    the pixel at src[i] in place of pos[i]. Ties keep the order found, as the
+    per row sorted() did.
+    With quantised, brightness is rounded to 8 bits and the sorts are counting
+    sorts (O(N)); pixels whose brightness rounds the same then count as ties.
+    """
+
+    w, h = labels.shape
+    label, rank = labels.ravel(), order.ravel()
+    y = np.tile(np.arange(h), w)
+
+    if not quantised:
+        return np.lexsort((rank, y, label)), np.lexsort((rank, matrix.ravel(), y, label))
+
+    # pixels in the order they were found (order is a permutation)
+    visit = np.empty_like(rank)
+    visit[rank] = np.arange(w * h)
+    brightness = np.clip(np.rint(matrix.ravel()), 0, 255).astype(np.uint8)
+
+    return radix_argsort((y, label), visit), radix_argsort((brightness, y, label), visit)
+
 
+def brightness_matrix(img_pix):
+    """Brightness of every pixel of an (h, w, 3) image array at once, indexed [x, y]."""
+    return luminance(np.moveaxis(img_pix, -1, 0)).T
 
-def sort_pixels_by_brightness(pixels):
-    """Sort an array of pixels by their brightness."""
-    return sorted(pixels, key=luminance)
+
+def sort_image(img_pix, labels, order, matrix, quantised=False):
+    """Sort every shape's rows of an (h, w, 3) image array by brightness, giving a new array."""
+
+    w, h = labels.shape
+    # sort every shape's rows at once, on pixels flattened in [x, y] order like the labels
+    pos, src = sort_rows(labels, order, matrix, quantised)
+    flat_pix = img_pix.transpose(1, 0, 2).reshape(w * h, 3)
+    new_flat = np.empty_like(flat_pix)
+    new_flat[pos] = flat_pix[src]
+
+    return np.ascontiguousarray(new_flat.reshape(w, h, 3).transpose(1, 0, 2))
+
+
+def sweep(img_pix, tolerances, seed_relative=True, quantised=False, debug=False):
+    """Pixel sort an (h, w, 3) image array at each tolerance in turn, yielding (tolerance, new array).
+
+    The brightness matrix is worked out once, for all the tolerances. Without
+    seed_relative, the shapes are also built up from one tolerance to the next
+    (label_sweep), so a rising sweep costs about one labelling.
+    """
+
+    bm = brightness_matrix(img_pix)
+    if seed_relative:
+        shapes = ((tol, label_shapes(bm, tol, return_order=True)) for tol in tolerances)
+    else:
+        order = np.arange(bm.size).reshape(bm.shape)
+        shapes = ((tol, (labels, order)) for tol, labels in label_sweep(bm, tolerances))
+
+    for tol, (labels, order) in shapes:
+        if debug:
+            print(f"t = {tol}")
+        yield tol, sort_image(img_pix, labels, order, bm, quantised)
+
+
+def create_shared(array):
+    """Copy an array into a new shared memory block, returning (block, shared array)."""
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    shared[:] = array
+    return block, shared
+
+
+def sweep_initialiser(specs, seed_relative, quantised):
+    """Attach a pool worker to the shared image & brightness matrix (read only)."""
+    global sweep_blocks, sweep_arrays, sweep_options
+    sweep_blocks = [shared_memory.SharedMemory(name=name) for name, shape, dtype in specs]
+    sweep_arrays = [np.ndarray(shape, dtype=dtype, buffer=block.buf)
+                    for block, (name, shape, dtype) in zip(sweep_blocks, specs)]
+    sweep_options = (seed_relative, quantised)
+
+
+def sweep_worker(tol):
+    """Pixel sort the shared image at one tolerance."""
+    img_pix, bm = sweep_arrays
+    seed_relative, quantised = sweep_options
+    labels, order = label_shapes(bm, tol, seed_relative, return_order=True)
+    return tol, sort_image(img_pix, labels, order, bm, quantised)
+
+
+def parallel_sweep(img_pix, tolerances, seed_relative=True, quantised=False, workers=None, window=None,
+                   debug=False):
+    """As sweep, with the tolerances spread over a pool of processes.
+
+    The image and brightness matrix are put in shared memory once, for the
+    workers to read. Frames still come out in the order of tolerances: at most
+    window (default twice the workers) are in hand at once, and any that finish
+    early wait for the ones before them. Each worker labels its tolerance from
+    scratch.
+    """
+
+    tolerances = list(tolerances)
+    workers = workers or os.cpu_count()
+    window = window or 2 * workers
+
+    blocks = []
+    try:
+        specs = []
+        for array in (img_pix, brightness_matrix(img_pix)):
+            block, shared = create_shared(array)
+            blocks.append(block)
+            specs.append((block.name, shared.shape, shared.dtype))
+
+        with mp.Pool(workers, sweep_initialiser, (specs, seed_relative, quantised)) as pool:
+            pending = {}    # frames submitted, by index: also holds those done early
+            submitted = 0
+            for i in range(len(tolerances)):
+                while submitted < min(i + window, len(tolerances)):
+                    pending[submitted] = pool.apply_async(sweep_worker, (tolerances[submitted],))
+                    submitted += 1
+                tol, frame = pending.pop(i).get()
+                if debug:
+                    print(f"t = {tol}")
+                yield tol, frame
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
 
 
 def runner(args):
@@ -120,45 +230,25 @@ def runner(args):
     image = open_image(image_file, debug)
     # get file name w/o extension
     file_name, file_extension = os.path.splitext(image_file)
-    # get dimensions of original image
-    w, h = image.size
-    # get pixels from original image
-    img_pix = image.load()
-    # initialise new image
-    new_image = Image.new('RGB', (w, h))
+    # get pixels from original image, as an (h, w, 3) array
+    img_pix = np.asarray(image)
 
     # CREATE BRIGHTNESS MATRIX #
-    # initialise brightness matrix
-    bm = np.zeros((w, h))
-    # fill out the brightness matrix
-    for x in range(w):
-        for y in range(h):
-            p = (x, y)
-            pix = img_pix[p]
-            bm[x, y] = luminance(pix)
+    # brightness of every pixel at once, indexed [x, y]
+    bm = brightness_matrix(img_pix)
 
     # FIND SHAPES #
     # based on the brightness, find shapes/areas of similar brightness
-    shapes = find_shapes(bm, args)
+    labels, order = find_shapes(bm, args)
 
     # PROCESS SHAPES #
     if debug:
         print("sort_pixels")
-    for shape in shapes:
-        rows = defaultdict(list)
-        for x, y in shape:
-            rows[y].append((x, y))
-
-        for y, coords in rows.items():
-            all_pixels = [img_pix[(x, y)] for x, y in coords]
-            sorted_pixels = sort_pixels_by_brightness(all_pixels)
-
-            for i, (j, k) in enumerate(coords):
-                new_image.putpixel((j, k), sorted_pixels[i])
+    new_pix = sort_image(img_pix, labels, order, bm, args.quantised)
 
     # FINISH UP #
     # save end product
-    new_image.save(f"{file_name}_deranged_t{tolerance}.png")
+    Image.fromarray(new_pix).save(f"{file_name}_deranged_t{tolerance}.png")
     # close original image file
     image.close()
     print(":)")
@@ -172,6 +262,11 @@ if __name__ == '__main__':
     parser.add_argument('image_in', type=str, help='Image file to process.')  # Required
     parser.add_argument('--debug', action='store_true', help='Option to enable debug mode.')   # Optional
     parser.add_argument('--tolerance', type=int, default=50, help='Tolerance for brightness grouping.')   # Optional
+    parser.add_argument('--grouping', choices=['seed', 'neighbour'], default='seed',
+                        help='Compare pixels to the seed of their shape, or to their neighbours.')   # Optional
+    parser.add_argument('--quantised', action='store_true',
+                        help='Sort on brightness rounded to 8 bits, with a counting sort (faster, '
+                             'but rounded ties can reorder).')   # Optional
     # Parse:
     input_args = parser.parse_args()
 
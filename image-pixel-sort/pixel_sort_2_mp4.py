@@ -8,38 +8,59 @@
 import argparse                 # To process command line arguments.
 import os                       # to get file name and extension
 import imageio.v2 as imageio    # to make the .mp4 file
-import subprocess               # recommended over os for system calls  #but really should import other file...
+import numpy as np              # to hand the image to the pixel sort as an array
+from PIL import Image           # to save the frames, if kept
+import pixel_sort               # the pixel sort itself, run in this process (or a pool of them)
 
-# parse image arguments
-parser = argparse.ArgumentParser(description='Takes an image file and deranges it a la pixel sorting, then creates a '
-                                             'mp4 by combing all the outputs of the pixel sort program.')
-parser.add_argument('image_in', type=str, help='Image file to process.')
-args = parser.parse_args()
+# (guarded, as the worker processes of --workers may import this file)
+if __name__ == '__main__':
+    # parse image arguments
+    parser = argparse.ArgumentParser(description='Takes an image file and deranges it a la pixel sorting, then '
+                                                 'creates a mp4 by combing all the outputs of the pixel sort program.')
+    parser.add_argument('image_in', type=str, help='Image file to process.')
+    parser.add_argument('--debug', action='store_true', help='Option to enable debug mode.')
+    parser.add_argument('--tol-min', type=int, default=0, help='First tolerance of the sweep.')
+    parser.add_argument('--tol-max', type=int, default=200, help='End of the sweep (not included).')
+    parser.add_argument('--tol-step', type=int, default=10, help='Step between tolerances.')
+    parser.add_argument('--fps', type=float, default=10, help='Frames per second of the mp4.')
+    parser.add_argument('--keep-frames', action='store_true',
+                        help='Also save each frame as a png, as pixel_sort.py would.')
+    parser.add_argument('--grouping', choices=['seed', 'neighbour'], default='seed',
+                        help='Compare pixels to the seed of their shape, or to their neighbours (the neighbour '
+                             'shapes are built up over the sweep, so cost about one labelling in all).')
+    parser.add_argument('--quantised', action='store_true',
+                        help='Sort on brightness rounded to 8 bits, with a counting sort.')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Make the frames in parallel with this many processes.')
+    parser.add_argument('--window', type=int, default=0,
+                        help='With --workers, most frames in hand at once (default twice the workers).')
+    args = parser.parse_args()
 
-# get image info.
-image_file = args.image_in
-file_name, file_extension = os.path.splitext(image_file)
+    # get image info.
+    image_file = args.image_in
+    file_name, file_extension = os.path.splitext(image_file)
 
-# parameters for loops
-tol_max = 200
-tol_step = 10
-tolerances = []
-filenames = []
+    # decode the image once, for every tolerance
+    image = pixel_sort.open_image(image_file, args.debug)
+    img_pix = np.asarray(image)
+    tolerances = range(args.tol_min, args.tol_max, args.tol_step)
+    seed_relative = args.grouping == 'seed'
 
-# start loop, run pixel sort with increasing tolerances
-for t in range(0, tol_max, tol_step):
+    if args.workers:
+        frames = pixel_sort.parallel_sweep(img_pix, tolerances, seed_relative, args.quantised, args.workers,
+                                           args.window or None)
+    else:
+        frames = pixel_sort.sweep(img_pix, tolerances, seed_relative, args.quantised)
 
-    print(f't = {t}')
-    subprocess.call(f'python3 pixel_sort.py {image_file} --tolerance {t}', shell=True)
-    filenames.append(f'{file_name}_deranged_t{t}.png')
+    # run pixel sort with increasing tolerances, straight into the mp4 (in order)
+    with imageio.get_writer(f'{file_name}_deranged.mp4', fps=args.fps) as writer:
+        for t, frame in frames:
 
+            print(f't = {t}')
+            writer.append_data(frame)
+            if args.keep_frames:
+                Image.fromarray(frame).save(f'{file_name}_deranged_t{t}.png')
 
-# combine these images into a mp4
-writer = imageio.get_writer(f'{file_name}_deranged.mp4', fps=10)
-
-for filename in filenames:
-    writer.append_data(imageio.imread(filename))
-
-writer.close()
+    image.close()
 
 # fin
@@ -10,35 +10,81 @@
 # https://www.youtube.com/watch?v=wUQbchYY80U
 ##################
 # imports:
-import sys                  # system stuff (to get input arguments)
+import argparse             # to process command line arguments
+import sys                  # system stuff (to exit)
 import os                   # operating system stuff (to get file extensions)
+import shutil               # to get the console size
+import io                   # in-memory streams (to get the output as a string)
 from PIL import Image       # Python Image Library
+from PIL import ImageDraw, ImageFont     # to draw the character glyphs
+import hashlib              # to name cached glyph files
+import tempfile             # to write the cached glyph files atomically
+import imageio.v2 as imageio    # to read video frames
 import numpy as np          # for the usual
 import time                 # to wait (when printing shapes to the console)
+# the shape labelling engine (shared with pixel_sort) lives at the top of the repo
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+from shape_labels import label_shapes      # noqa: E402
 
 ###################
 # control parameters:
 # internal:
 tolerance = 10              # um this probably shouldnt be hardcoded
+seed_relative = True        # compare shape pixels to the seed pixel (else to their neighbours)
 debug = False               # print misc. outputs
 print_culminative = True    # print the gradually building combo of all shapes
 print_shapes = False         # print bfs shapes to console
 save_shapes = False         # save bfs shapes to files (careful, can produce LOTS of files)
 use_luminance_form = True   # formula for brightness from pixel rgb
 print_to_console = True     # show results of bfs shape finder on console
-# external (changed by user input):
+output_buffer_size = 1 << 16    # bytes of text written per flush
+colour_mode = None          # None for plain text, or "256" / "truecolor" ansi colours
+redraw_gap = 8              # unchanged characters worth rewriting rather than moving the cursor over
+glyph_cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "image2ascii")   # rendered glyphs
+# external (changed by command line arguments):
 print_to_file = False         # save final result to file
 bfs_grouping = False        # use bfs shape finder or not
+glyph_matching = False      # match pixel patches to character shapes (instead of brightness)
 # The character array to map brightness to:
 ASCII_CHARS = "`^\",:;Il!i~+_-?][}{1)(|\\/tfjrxnuvczXYUJCLQ0OZmwqpdbkhao*#MW&8%B@$"
 WOW_SNR = "123456789ABCDEFGHIJKLMNOPQRSTU"
 # light to dark, left to right
 char_map = WOW_SNR     # define here but properly initialise after user choice
+CHAR_SETS = {"ascii": ASCII_CHARS, "snr": WOW_SNR}
+xterm_lut = None       # rgb (5 bits each) to xterm-256 colour index, built when first needed
+glyph_bitmaps = {}     # character set to (glyphs, cell size), once rendered or loaded
 
 
 ############################################################
-def preprocess_image(img_file):
-    """Modify the image size to match the console, plus some minor preprocessing."""
+def resize_image(img, width):
+    """Resize the image to the given number of characters across.
+
+    Each character cell gets the mean of the area of pixels it covers. JPEGs
+    are decoded at a reduced size first (if that still leaves at least a pixel
+    per cell), so decode time and memory follow the output size, not the input.
+    """
+
+    w, h = img.size
+    aspect_ratio = w/h                              # would H/W be better
+
+    new_width = width
+    new_height = int(new_width/aspect_ratio/2)      # factor of two to account for character aspect
+
+    img.draft('RGB', (new_width, new_height))       # only does anything for unloaded jpegs
+    img = img.convert('RGB')
+    w, h = img.size
+
+    if w < new_width or h < new_height:
+        # blowing the image up, so there's nothing to average
+        return img.resize((new_width, new_height))
+
+    # box filter: each cell is the area average of the pixels it covers (fractions included)
+    return img.resize((new_width, new_height), Image.Resampling.BOX)
+
+
+############################################################
+def preprocess_image(img_file, width=None, resize=True):
+    """Modify the image size to match the console (or width), plus some minor preprocessing."""
 
     img = None  # initialise
     file_name, file_extension = os.path.splitext(img_file)
@@ -56,36 +102,36 @@ def preprocess_image(img_file):
     
     #
     # resize the image according to the output:
-    w, h = img.size
     if debug:
-        print('Original W, H =', (w, h))
+        print('Original W, H =', img.size)
 
-    if print_to_console:
+    if width is None and print_to_console:
         # use the console to resize the image
-        console_width = os.get_terminal_size().columns  # get console size
-        aspect_ratio = w/h                              # would H/W be better
-
-        new_width = console_width
-        new_height = int(new_width/aspect_ratio/2)      # factor of two to account for character aspect
+        width = shutil.get_terminal_size().columns  # get console size
 
-        img = img.resize((new_width, new_height))       # resize
+    if width and resize:
+        img = resize_image(img, width)
 
     if debug:
-        w, h = img.size
-        print('Resized W, H =', (w, h))
+        print('Resized W, H =', img.size)
 
     #######################
-    # convert image to RBG type
-    img = img.convert('RGB')
+    # convert image to RBG type (unless it's left for the caller to resize, e.g. glyph
+    # matching, which can then still decode jpegs at a reduced size)
+    if resize:
+        img = img.convert('RGB')
 
     return img, file_name
 
 
 ############################################################
-def get_brightness(r, g, b):
+def get_brightness(r, g, b, luminance=None):
     """Given a set of rgb values of a pixel, calculate brightness."""
 
-    if use_luminance_form:
+    if luminance is None:
+        luminance = use_luminance_form
+
+    if luminance:
         brightness = 0.299*r + 0.587*g + 0.114*b    # luminance formula
     else:
         brightness = sum([r, g, b]) / 3             # simple average
@@ -93,94 +139,272 @@ def get_brightness(r, g, b):
 
 
 ############################################################
-def bfs_search(matrix, start, tol, visited):
-    """Breadth first search algorithm."""
+def get_brightness_matrix(img, luminance=None):
+    """Brightness of every pixel at once, as a (W, H) matrix."""
+
+    # PIL gives the pixels as rows, i.e. (H, W, 3), so transpose to index by [x, y]
+    rgb = np.asarray(img, dtype=float).transpose(1, 0, 2)
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+
+    return get_brightness(r, g, b, luminance)
+
+
+############################################################
+def write_output(matrix, stream):
+    """Stream the character matrix as plain text, row by row, to a binary stream."""
 
     w, h = matrix.shape
-    queue = [start]
-    init = matrix[start]
-    group = []
+    row_len = w + 1                                     # characters plus newline
+    n_rows = max(1, output_buffer_size // row_len)      # rows per flush
+    # reusable buffer, viewed as a (rows, row length) array of single bytes
+    buffer = bytearray(n_rows * row_len)
+    rows = np.frombuffer(buffer, dtype='S1').reshape(n_rows, row_len)
+    rows[:, w] = b"\n"
+
+    n = 0
+    for y in range(h):
+        rows[n, :w] = matrix[:, y]      # character maps are plain ascii
+        n += 1
+        if n == n_rows:
+            stream.write(buffer)
+            n = 0
+    if n:
+        stream.write(memoryview(buffer)[:n * row_len])
+
+
+############################################################
+def get_output(matrix):
+    """Formatting for printing the character matrix as plain text."""
 
-    while queue:
-        x, y = queue.pop(0)
+    stream = io.BytesIO()
+    write_output(matrix, stream)
 
-        if not visited[x, y]:
+    return stream.getvalue().decode()
 
-            visited[x, y] = True
-            group.append((x, y))
 
-            for i in range(max(0, x-1), min(w, x+2)):
-                for j in range(max(0, y-1), min(h, y+2)):
-                    if not visited[i, j] and abs(matrix[i, j] - init) <= tol:
-                        queue.append((i, j))
+############################################################
+def get_colour_matrix(img):
+    """RGB of every pixel, as a (W, H, 3) matrix to match the character matrix."""
 
-    return group
+    return np.asarray(img, dtype=np.uint8).transpose(1, 0, 2)
 
 
 ############################################################
-def find_shapes(matrix, tol):
-    """Use the bfs pathfinder to get subsets of similar brightness."""
+def get_xterm_lut():
+    """Lookup table from rgb (top 5 bits of each) to the nearest xterm-256 colour.
 
-    w, h = matrix.shape
-    shapes = []
-    visited = np.zeros((w, h), dtype=bool)
+    Only the colour cube and grey ramp (16 to 255) are used, as the first 16
+    colours depend on the terminal theme. Built once, then kept.
+    """
+
+    global xterm_lut
 
-    for x in range(w):
-        for y in range(h):
-            if not visited[x, y]:
-                shape = bfs_search(matrix, (x, y), tol, visited)
-                shapes.append(shape)
+    if xterm_lut is None:
+        # the xterm-256 palette
+        levels = np.array([0, 95, 135, 175, 215, 255])
+        cube = np.stack(np.meshgrid(levels, levels, levels, indexing='ij'), axis=-1).reshape(-1, 3)
+        greys = np.repeat(np.arange(8, 248, 10), 3).reshape(-1, 3)
+        palette = np.concatenate((cube, greys))
 
-    return shapes
+        # nearest palette colour to the centre of each bin
+        centres = np.arange(4, 256, 8)
+        bins = np.stack(np.meshgrid(centres, centres, centres, indexing='ij'), axis=-1).reshape(-1, 1, 3)
+        nearest = np.empty(len(bins), dtype=np.uint8)
+        for i in range(0, len(bins), 4096):         # a chunk at a time, to keep memory down
+            distance = ((bins[i:i + 4096] - palette) ** 2).sum(axis=2)
+            nearest[i:i + 4096] = 16 + distance.argmin(axis=1)
+        xterm_lut = nearest.reshape(32, 32, 32)
+
+    return xterm_lut
 
 
 ############################################################
-def get_output(matrix):
-    """Formatting for printing the character matrix as plain text."""
+def write_colour_output(matrix, rgb, stream, mode="truecolor"):
+    """Stream the character matrix with ansi colours (rgb indexed [x, y] like the matrix).
+
+    Each row is split into runs of the same colour, and each run gets one
+    escape code, rather than one per character.
+    """
 
     w, h = matrix.shape
-    output = ""
+    if mode == "256":
+        lut = get_xterm_lut()
+        colours = lut[rgb[..., 0] >> 3, rgb[..., 1] >> 3, rgb[..., 2] >> 3].astype(np.int64)
+    else:
+        colours = rgb.astype(np.int64) @ [1 << 16, 1 << 8, 1]      # one number per colour
+
+    buffer = bytearray()
     for y in range(h):
-        for x in range(w):
-            output += matrix[x, y]
-        if not y == h:
-            output += "\n"
+        row = matrix[:, y].astype('S1')
+        column = colours[:, y]
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(column)) + 1))
+        ends = np.concatenate((starts[1:], [w]))
+        for x0, x1, colour in zip(starts.tolist(), ends.tolist(), column[starts].tolist()):
+            if mode == "256":
+                buffer += b"\x1b[38;5;%im" % colour
+            else:
+                buffer += b"\x1b[38;2;%i;%i;%im" % (colour >> 16, (colour >> 8) & 255, colour & 255)
+            buffer += row[x0:x1].tobytes()
+        buffer += b"\x1b[0m\n"
+        if len(buffer) >= output_buffer_size:
+            stream.write(buffer)
+            buffer.clear()
+    stream.write(buffer)
+
+
+############################################################
+def print_output_to_console(matrix, rgb=None):
+    """What it says on the packet (in colour, if colour_mode and rgb are given)."""
+
+    sys.stdout.flush()              # keep any earlier (text) prints in order
+    stream = sys.stdout.buffer
+    if colour_mode and rgb is not None:
+        write_colour_output(matrix, rgb, stream, colour_mode)
+    else:
+        write_output(matrix, stream)
+    stream.write(b"\n")
+    stream.flush()
+
+
+############################################################
+def save_output_to_file(matrix, file, rgb=None):
+    """What it says on the packet (in colour, if colour_mode and rgb are given)."""
+
+    with open(file, "wb") as f:
+        if colour_mode and rgb is not None:
+            write_colour_output(matrix, rgb, f, colour_mode)
+        else:
+            write_output(matrix, f)
+
+
+############################################################
+class ConsoleRenderer:
+    """Draws character matrices in place on the console, only rewriting what changed.
+
+    The last drawn frame is kept, and each new frame is compared against it.
+    Changed characters are grouped into runs along each row, and only those
+    runs are written, each after an ANSI cursor move. Runs closer together
+    than redraw_gap are joined, as rewriting a few unchanged characters is
+    cheaper than another cursor move.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream        # binary stream, stdout by default
+        self.previous = None        # last drawn frame, as (H, W) bytes
+        self.bytes_written = 0
+
+    def draw(self, matrix):
+        """Draw the character matrix (indexed [x, y]) over the previous one."""
+
+        frame = matrix.T.astype('S1')
+        h, w = frame.shape
+        out = bytearray()
+
+        if self.previous is None or self.previous.shape != frame.shape:
+            # nothing to compare against: clear the screen and draw it all
+            out += b"\x1b[2J"
+            for y in range(h):
+                out += b"\x1b[%i;1H" % (y + 1)
+                out += frame[y].tobytes()
+        else:
+            changed = np.flatnonzero(frame != self.previous)
+            if len(changed):
+                rows, cols = np.divmod(changed, w)
+                # a run starts at a new row or after a long enough gap
+                starts = np.flatnonzero((np.diff(rows) != 0) | (np.diff(cols) > redraw_gap)) + 1
+                starts = np.concatenate(([0], starts))
+                ends = np.concatenate((starts[1:], [len(changed)])) - 1
+                for y, x0, x1 in zip(rows[starts].tolist(), cols[starts].tolist(), cols[ends].tolist()):
+                    out += b"\x1b[%i;%iH" % (y + 1, x0 + 1)
+                    out += frame[y, x0:x1 + 1].tobytes()
+
+        self.previous = frame
+        self.write(out)
+
+    def close(self):
+        """Move the cursor below the drawn frame."""
+
+        if self.previous is not None:
+            self.write(b"\x1b[%i;1H" % (self.previous.shape[0] + 1))
 
-    return output
+    def write(self, out):
+        """Write to the stream in one go."""
+
+        if self.stream is None:
+            sys.stdout.flush()
+            self.stream = sys.stdout.buffer
+        self.stream.write(out)
+        self.stream.flush()
+        self.bytes_written += len(out)
 
 
 ############################################################
-def print_output_to_console(matrix):
-    """What it says on the packet."""
+def get_shape_stats(labels, matrix):
+    """Pixel count, mean brightness and bounding box of every shape, in one pass."""
+
+    flat = labels.ravel()
+    counts = np.bincount(flat)
+    means = np.bincount(flat, weights=matrix.ravel()) / counts
+
+    # bounding boxes as rows of (x min, x max, y min, y max), inclusive
+    w, h = labels.shape
+    xs, ys = np.divmod(np.arange(w * h), h)
+    boxes = np.empty((len(counts), 4), dtype=int)
+    boxes[:, [0, 2]] = [w, h]
+    boxes[:, [1, 3]] = -1
+    np.minimum.at(boxes[:, 0], flat, xs)
+    np.maximum.at(boxes[:, 1], flat, xs)
+    np.minimum.at(boxes[:, 2], flat, ys)
+    np.maximum.at(boxes[:, 3], flat, ys)
 
-    output = get_output(matrix)
-    print(output)
+    return counts, means, boxes
 
 
 ############################################################
-def save_output_to_file(matrix, file):
-    """What it says on the packet."""
+def show_shapes(labels, shape_chars, boxes):
+    """Print (or save) the shapes one by one, as the character matrix builds up."""
+
+    W, H = labels.shape
+    char_matrix = np.full((W, H), ' ', dtype=str)
+    renderer = ConsoleRenderer()
+
+    for shape_num, (char, (x0, x1, y0, y1)) in enumerate(zip(shape_chars, boxes), start=1):
+        # only the bounding box of the shape needs looking at
+        box = (slice(x0, x1 + 1), slice(y0, y1 + 1))
+        in_shape = labels[box] == shape_num - 1
+        # add to the culminative total matrix:
+        char_matrix[box][in_shape] = char
+
+        if print_to_file and save_shapes:
+            shape_matrix = np.full((W, H), ' ', dtype=str)
+            shape_matrix[box][in_shape] = char
+            save_output_to_file(shape_matrix, "shape_%i.txt" % shape_num)
+        elif print_to_console:
+            if print_shapes:
+                shape_matrix = np.full((W, H), ' ', dtype=str)
+                shape_matrix[box][in_shape] = char
+                renderer.draw(shape_matrix)
+                time.sleep(0.1)
+            if print_culminative:
+                renderer.draw(char_matrix)
+            time.sleep(0.1)
 
-    output = get_output(matrix)
-    f = open(file, "wt")
-    f.write(output)
-    f.close()
+    renderer.close()
 
 
 ############################################################
-def img2ascii_convertor(img, file):
+def img2ascii_convertor(img, file, output_file=None, width=None):
     """First, convert the image to brightness, then map to characters."""
 
+    if glyph_matching:
+        # the image is still full size (and not yet decoded), and each cell is matched by shape
+        char_matrix = get_glyph_matrix(img, width)
+        rgb = get_colour_matrix(img.convert('RGB').resize(char_matrix.shape)) if colour_mode else None
+        output_char_matrix(char_matrix, file, output_file, rgb)
+        return
+
     # convert image into brightness matrix (averaged rgb values for each pixel)
-    W, H = img.size             # get img (new) dimensions (again)
-    BM = np.zeros((W, H))       # initialise (dark) matrix
-
-    for X in range(W):
-        for Y in range(H):
-            pos = (X, Y)                    # get position
-            pixel_rgb = img.getpixel(pos)    # get RGB
-            r, g, b = pixel_rgb
-            BM[X, Y] = get_brightness(r, g, b)
+    BM = get_brightness_matrix(img)
     #
     if debug:
         print("BM")
@@ -188,142 +412,331 @@ def img2ascii_convertor(img, file):
 
     # the bfs tolerance should depend on the max & min of the BM...
 
-    # initialise (empty) matrix of characters
-    char_matrix = np.full((W, H), ' ', dtype=str)
-
     # find the character matrix:
     if bfs_grouping:
         if debug:
             print("finding shapes")
 
-        shapes = find_shapes(BM, tolerance)
-        shape_num = 0
+        labels = label_shapes(BM, tolerance, seed_relative)
+        counts, means, boxes = get_shape_stats(labels, BM)
+        # find character for average brightness of each group:
+        shape_chars = get_chars_from_b(means)
         if debug:
-            print("num of shapes =", len(shapes))
-        for shape in shapes:
+            print("num of shapes =", len(counts))
 
-            # defn function to get shape matrix ?
+        if (print_to_file and save_shapes) or (print_to_console and (print_shapes or print_culminative)):
+            show_shapes(labels, shape_chars, boxes)
 
-            # initialise (empty) matrix
-            shape_matrix = np.full((W, H), ' ', dtype=str)
-            shape_num += 1
-            #
-            for x, y in shape:
-                # find character for average brightness of the group:
-                b_av = np.mean([BM[x, y] for x, y in shape])
-                shape_matrix[x, y] = get_char_from_b(b_av)
-                # add to the culminative total matrix:
-                char_matrix[x, y] = shape_matrix[x, y]
-
-            if print_to_file and save_shapes:
-                save_output_to_file(shape_matrix, "shape_%i.txt" % shape_num)
-            elif print_to_console:
-                if print_shapes:
-                    print_output_to_console(shape_matrix)
-                    time.sleep(0.1)
-                if print_culminative:
-                    print_output_to_console(char_matrix)
-                time.sleep(0.1)
+        char_matrix = shape_chars[labels]
 
     else:   # no bfs shape finder...
-        for Y in range(H):
-            for X in range(W):
-                char_matrix[X, Y] = get_char_from_b(BM[X, Y])
+        char_matrix = get_chars_from_b(BM)
     #
+    rgb = get_colour_matrix(img) if colour_mode else None
+    output_char_matrix(char_matrix, file, output_file, rgb)
+
+
+############################################################
+def output_char_matrix(char_matrix, file, output_file=None, rgb=None):
+    """Save and/or print the final character matrix."""
+
     if print_to_file:
-        save_output_to_file(char_matrix, "%s_ascii.txt" % file)
+        save_output_to_file(char_matrix, output_file or "%s_ascii.txt" % file, rgb)
     if print_to_console:
-        print_output_to_console(char_matrix)
+        print_output_to_console(char_matrix, rgb)
 
 
 ############################################################
-def get_char_from_b(brightness):
-    """Convert brightness into ascii"""
+def get_char_lut(chars=None):
+    """Lookup table from character index to character (for char_map by default)."""
 
-    index = int((len(char_map) - 1) * (brightness / 255.0))
-    return char_map[index]
+    if chars is None:
+        chars = char_map
+
+    return np.array(list(chars), dtype=str)
+
+
+############################################################
+def get_chars_from_b(brightness, chars=None):
+    """Convert a whole brightness matrix into ascii (0-255 spread evenly over the characters)."""
+
+    lut = get_char_lut(chars)
+    # brightness is fractional, so scale it to an index (rounding down), then look up
+    index = ((len(lut) - 1) * (brightness / 255.0)).astype(int)
+    return lut[index]
+
+
+############################################################
+def get_glyphs(chars):
+    """Bitmaps of every character, rendered in the default font, as (glyphs, (w, h)).
+
+    glyphs has one flattened (h, w) bitmap per row, ink bright on dark to match
+    the brightness mapping. They are rendered once per character set and cached
+    on disk (and in memory), keyed by the character set and font.
+    """
+
+    if chars in glyph_bitmaps:
+        return glyph_bitmaps[chars]
+
+    font = ImageFont.load_default()
+    key = hashlib.md5((chars + repr(font.getmetrics()) + Image.__version__).encode()).hexdigest()
+    cache_file = os.path.join(glyph_cache_dir, "glyphs_%s.npy" % key)
+
+    if os.path.exists(cache_file):
+        glyphs = np.load(cache_file)
+    else:
+        ascent, descent = font.getmetrics()
+        w, h = int(np.ceil(max(font.getlength(c) for c in chars))), ascent + descent
+        glyphs = np.zeros((len(chars), h, w), dtype=np.float32)
+        for i, c in enumerate(chars):
+            bitmap = Image.new('L', (w, h), 0)
+            ImageDraw.Draw(bitmap).text((0, 0), c, fill=255, font=font)
+            glyphs[i] = np.asarray(bitmap)
+        # write to a temporary file & rename it into place, so a process reading
+        # the cache at the same time never sees a part-written file
+        os.makedirs(glyph_cache_dir, exist_ok=True)
+        fd, temp_file = tempfile.mkstemp(suffix=".npy", dir=glyph_cache_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, glyphs)
+            os.replace(temp_file, cache_file)
+        except BaseException:
+            os.remove(temp_file)
+            raise
+
+    n, h, w = glyphs.shape
+    glyph_bitmaps[chars] = glyphs.reshape(n, h * w), (w, h)
+
+    return glyph_bitmaps[chars]
+
+
+############################################################
+def get_glyph_matrix(img, width=None, chars=None, luminance=None):
+    """Convert an image into a character matrix by matching each cell to a glyph's shape.
+
+    The image is resized so each character cell covers a glyph-sized patch of
+    pixels, and every patch is compared with every glyph in one matrix product;
+    the closest glyph (least squared difference) wins.
+    """
+
+    if chars is None:
+        chars = char_map
+    glyphs, (cell_w, cell_h) = get_glyphs(chars)
+
+    w, h = img.size
+    cols = width or w // cell_w
+    rows = max(1, int(cols * cell_w * h / w / cell_h))
+
+    img.draft('RGB', (cols * cell_w, rows * cell_h))   # only does anything for unloaded jpegs
+    img = img.convert('RGB').resize((cols * cell_w, rows * cell_h), Image.Resampling.BOX)
+    BM = get_brightness_matrix(img, luminance).T        # back to rows of pixels
+    patches = BM.reshape(rows, cell_h, cols, cell_w).transpose(0, 2, 1, 3)
+    patches = patches.reshape(rows * cols, cell_h * cell_w).astype(np.float32)
+
+    # |p - g|^2 = |p|^2 - 2 p.g + |g|^2, and |p|^2 is the same for every glyph
+    scores = patches @ (2 * glyphs.T) - (glyphs ** 2).sum(axis=1)
+    index = scores.argmax(axis=1).reshape(rows, cols).T
+
+    return get_char_lut(chars)[index]
+
+
+############################################################
+def convert_image(img, width=None, chars=ASCII_CHARS, grouping=False, tol=10, seed=True, luminance=True,
+                  glyphs=False):
+    """Convert an image into a character matrix, indexed [x, y].
+
+    img can be a file name, a PIL image or an (H, W, 3) rgb array. All options
+    are explicit: nothing is asked, printed or saved, and the module settings
+    are not used. Use get_output on the result to get plain text.
+    With glyphs, characters are matched by shape rather than by brightness.
+    """
+
+    if isinstance(img, str):
+        img = Image.open(img)
+    if not isinstance(img, Image.Image):
+        img = Image.fromarray(np.asarray(img, dtype=np.uint8))
+
+    if glyphs:
+        return get_glyph_matrix(img, width, chars, luminance)
+
+    if width:
+        img = resize_image(img, width)
+    img = img.convert('RGB')
+
+    BM = get_brightness_matrix(img, luminance)
+
+    if not grouping:
+        return get_chars_from_b(BM, chars)
+
+    labels = label_shapes(BM, tol, seed)
+    counts, means, boxes = get_shape_stats(labels, BM)
+
+    return get_chars_from_b(means, chars)[labels]
+
+
+############################################################
+def video_frames(video_file):
+    """Decode the frames of a video one at a time, yielding (fps, rgb array)."""
+
+    reader = imageio.get_reader(video_file)
+    try:
+        fps = reader.get_meta_data().get('fps') or 25   # assume 25 if unknown
+        for frame in reader:
+            yield fps, frame[..., :3]
+    finally:
+        reader.close()
+
+
+############################################################
+def video2ascii(video_file, width=None, skip=None, **options):
+    """Lazily convert the frames of a video, yielding (index, fps, character matrix).
+
+    skip(index, fps) can return True to drop a frame without converting it
+    (it is still decoded, as readers go frame by frame). The other options
+    are passed on to convert_image.
+    """
+
+    for index, (fps, frame) in enumerate(video_frames(video_file)):
+        if skip is not None and skip(index, fps):
+            continue
+        yield index, fps, convert_image(frame, width, **options)
+
+
+############################################################
+def play_video(video_file, width=None, **options):
+    """Play a video in the console at its own frame rate, dropping frames when behind.
+
+    Returns the frames per second converted, and the number of frames dropped.
+    """
+
+    start = time.perf_counter()
+    dropped = 0
+
+    def behind(index, fps):
+        nonlocal dropped
+        # drop the frame if the next one is already due
+        late = time.perf_counter() - start > (index + 1) / fps
+        if late:
+            dropped += 1
+        return late
+
+    shown = 0
+    renderer = ConsoleRenderer()
+    for index, fps, matrix in video2ascii(video_file, width, skip=behind, **options):
+        wait = start + index / fps - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        renderer.draw(matrix)
+        shown += 1
+
+    renderer.close()
+    return shown / (time.perf_counter() - start), dropped
+
+
+############################################################
+def save_video(video_file, output_file, width=None, **options):
+    """Convert every frame of a video into one text file, each frame headed by its index.
+
+    Returns the frames per second converted.
+    """
+
+    start = time.perf_counter()
+    converted = 0
+    with open(output_file, "wb") as f:
+        for index, fps, matrix in video2ascii(video_file, width, **options):
+            f.write(b"# frame %i\n" % index)
+            write_output(matrix, f)
+            converted += 1
+
+    return converted / (time.perf_counter() - start)
 
 
 ############################################################
 def process_user_input():
-    """Process user input."""
+    """Process the command line arguments."""
 
     global print_to_console
     global print_to_file
     global bfs_grouping
     global char_map
-
-    # confirm required image file supplied
-    if len(sys.argv) != 2:
-        print("Try: python image2ascii.py <image_file>")
-        sys.exit(1)
-
-    # ask for options:
-    # print to file as well as console...
-    io_file = {"y", "yes", "file", ""}
-    io_no_file = {"n", "no"}
-    print("Would u like to print to file [y/n]? (Default is [y].)")
-    while True:
-        user_in = input().strip().lower()
-        if user_in in io_file or user_in in io_no_file:
-            print_to_file = user_in in io_file
-            if print_to_file and debug:
-                print("printing to file.")
-            break
-            ###
-        else:
-            print("Please enter y or n...")
-
-    # use BFS to find shapes or not:
-    io_bfs = {"y", "yes", "bfs", ""}
-    io_no_bfs = {"n", "no"}
-    print("Would u like to use BFS shape grouping [y/n]? (Default is [y].)")
-    while True:
-        user_in = input().strip().lower()
-        if user_in in io_bfs or user_in in io_no_bfs:
-            bfs_grouping = user_in in io_bfs
-            if debug:
-                print("bfs grouping", "applied" if bfs_grouping else "not applied")
-            break
-            ###
-        else:
-            print("Please enter 1 or 2, or 'bfs' or 'no'...")
-
-    # which character map to use:
-    opts_in_ascii = {"1", "ascii", ""}
-    opts_in_snr = {"2", "snr", "wow"}
-    print("Which character set would you like to map to:")
-    print("[1]. Classic Ascii: " + ASCII_CHARS)
-    print("[2]. WOW SNR values: " + WOW_SNR)
-    print("(Default is [1].)")
-    while True:
-        user_in = input().strip().lower()
-        if user_in in opts_in_ascii or user_in in opts_in_snr:
-            if user_in in opts_in_ascii:
-                char_map = ASCII_CHARS
-            else:
-                char_map = WOW_SNR
-            if debug:
-                print("mapping to ", "ascii" if user_in in opts_in_ascii else "snr")
-            break
-            ###
-        else:
-            print("Please enter 1 or 2, or 'ascii' or 'snr'...")
+    global tolerance
+    global seed_relative
+    global debug
+    global colour_mode
+    global glyph_matching
+
+    parser = argparse.ArgumentParser(description='Takes an image file and converts it to ascii art.')
+    parser.add_argument('image_in', type=str, help='Image file to process.')
+    parser.add_argument('--width', type=int, help='Characters across (default is the console width).')
+    parser.add_argument('--charset', choices=sorted(CHAR_SETS), default='ascii',
+                        help='Character set to map to: classic ascii, or WOW SNR values.')
+    parser.add_argument('--bfs', action='store_true', help='Use BFS shape grouping.')
+    parser.add_argument('--glyphs', action='store_true',
+                        help='Match characters to the shapes in the image, not just the brightness.')
+    parser.add_argument('--tolerance', type=float, default=tolerance, help='Tolerance for brightness grouping.')
+    parser.add_argument('--grouping', choices=['seed', 'neighbour'], default='seed',
+                        help='Compare pixels to the seed of their shape, or to their neighbours.')
+    parser.add_argument('-o', '--output', nargs='?', const='',
+                        help='Save to file (default name is <image>_ascii.txt).')
+    parser.add_argument('--no-console', action='store_true', help='Do not print to the console.')
+    parser.add_argument('--colour', choices=['256', 'truecolor'],
+                        help='Colour each character with its pixel (xterm-256 or 24-bit).')
+    parser.add_argument('--video', action='store_true',
+                        help='The input is a video: play it, or save all frames to the output file.')
+    parser.add_argument('--debug', action='store_true', help='Option to enable debug mode.')
+    args = parser.parse_args()
+
+    print_to_console = not args.no_console
+    print_to_file = args.output is not None
+    bfs_grouping = args.bfs
+    char_map = CHAR_SETS[args.charset]
+    tolerance = args.tolerance
+    seed_relative = args.grouping == 'seed'
+    debug = args.debug
+    colour_mode = args.colour
+    glyph_matching = args.glyphs
+
+    return args
 
 
 ############################################################
 def main():
     """Runs the subroutines."""
 
-    os.system("clear")
-    os.system("figlet -f future THE CHARACTERIZER")
+    # expected cli usage is: ./image2ascii.py imagefile.png [options]
+    args = process_user_input()
+
+    if debug:
+        os.system("figlet -f future THE CHARACTERIZER")
+
+    if args.video:
+        run_video(args)
+        return
+
+    width = args.width
+    if glyph_matching and width is None and print_to_console:
+        width = shutil.get_terminal_size().columns
 
-    # get user choices (defaults are: save to file, use acsii...)
-    process_user_input()
-    # expected cli usage is: ./image2ascii.py imagefile.png
-    image_file, fileName = preprocess_image(sys.argv[1])
+    image_file, fileName = preprocess_image(args.image_in, width, resize=not glyph_matching)
     # call the runner
-    img2ascii_convertor(image_file, fileName)
+    img2ascii_convertor(image_file, fileName, args.output, width)
+
+
+############################################################
+def run_video(args):
+    """Play or save a video with the command line options."""
+
+    file_name, file_extension = os.path.splitext(args.image_in)
+    width = args.width or shutil.get_terminal_size().columns
+    options = dict(chars=char_map, grouping=bfs_grouping, tol=tolerance, seed=seed_relative,
+                   luminance=use_luminance_form, glyphs=glyph_matching)
+
+    if print_to_file:
+        fps = save_video(args.image_in, args.output or "%s_ascii.txt" % file_name, width, **options)
+        print("converted at %.1f frames per second" % fps)
+    elif print_to_console:
+        fps, dropped = play_video(args.image_in, width, **options)
+        print("\nplayed at %.1f frames per second (%i dropped)" % (fps, dropped))
 
 
 ############################################################
@@ -0,0 +1,154 @@
+####################
+# SHAPE LABELLING: #
+####################
+
+# Groups the pixels of a brightness matrix into shapes of similar brightness,
+# as an integer label per pixel. Shared by image2ascii (v2) and pixel_sort.
+
+# IMPORTS #
+import numpy as np                      # For matrix maths.
+from collections import deque           # double-ended queue -  to reduce pop O
+
+
+def bfs_search(values, w, h, seed, label, tol, labels, order, rank):
+    """Breadth first search from the seed, labelling pixels within tol of the seed value.
+
+    Works on the flattened matrix (index = x*h + y). Pixels are labelled as they
+    are queued, so each is queued once, and order records when each is visited.
+    Returns the next free rank.
+    """
+
+    directions = [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (1, 1), (-1, 1), (1, -1)]
+
+    init = values[seed]
+    labels[seed] = label
+    queue = deque([seed])
+
+    while queue:
+        p = queue.popleft()
+        order[p] = rank
+        rank += 1
+
+        x, y = divmod(p, h)
+        for dx, dy in directions:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < w and 0 <= ny < h:
+                q = nx * h + ny
+                if labels[q] < 0 and abs(values[q] - init) <= tol:
+                    labels[q] = label
+                    queue.append(q)
+
+    return rank
+
+
+def get_neighbour_pairs(w, h):
+    """Flat indices (a, b) of every pair of 8-connected neighbours in a (w, h) matrix."""
+
+    index = np.arange(w * h).reshape(w, h)
+    a = [index[:-1, :], index[:, :-1], index[:-1, :-1], index[:-1, 1:]]
+    b = [index[1:, :], index[:, 1:], index[1:, 1:], index[1:, :-1]]
+
+    return (np.concatenate([i.ravel() for i in a]),
+            np.concatenate([i.ravel() for i in b]))
+
+
+def merge_pairs(parent, a, b):
+    """Union-find over arrays: join the trees of each (a, b) pair, in place.
+
+    Every root points at the smallest index of its tree, so after merging the
+    root of a pixel is the first pixel of its shape in scan order.
+    """
+
+    while len(a):
+        # hook each larger root onto the smallest root it touches
+        ra, rb = parent[a], parent[b]
+        apart = ra != rb
+        a, b, ra, rb = a[apart], b[apart], ra[apart], rb[apart]
+        np.minimum.at(parent, np.maximum(ra, rb), np.minimum(ra, rb))
+        # then flatten the trees so parent holds the root again
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent[:] = grand
+
+    return parent
+
+
+def get_labels(parent, shape):
+    """Number the trees of a merged parent array 0, 1, ... in scan order."""
+
+    # a root is its tree's smallest index, so its label is the number of roots before it
+    roots = parent == np.arange(len(parent))
+    labels = np.cumsum(roots) - 1
+
+    return labels[parent].reshape(shape)
+
+
+def label_shapes(matrix, tol, seed_relative=True, return_order=False):
+    """Label areas of similar brightness, giving one integer label per pixel.
+
+    With seed_relative, a shape is grown from its seed (the first unlabelled
+    pixel in scan order) and holds the connected pixels within tol of the seed,
+    as the original bfs did. Otherwise, neighbouring pixels within tol of each
+    other are joined, with union-find over whole arrays.
+    Labels count up in scan order. With return_order, also return the visit
+    order of each pixel (the bfs order, or scan order without seed_relative).
+    """
+
+    w, h = matrix.shape
+
+    if seed_relative:
+        values = matrix.ravel().tolist()
+        labels = [-1] * (w * h)
+        order = [0] * (w * h)
+        label = rank = 0
+        for seed in range(w * h):
+            if labels[seed] < 0:
+                rank = bfs_search(values, w, h, seed, label, tol, labels, order, rank)
+                label += 1
+        labels = np.array(labels).reshape(w, h)
+        order = np.array(order).reshape(w, h)
+    else:
+        a, b = get_neighbour_pairs(w, h)
+        close = np.abs(matrix.ravel()[a] - matrix.ravel()[b]) <= tol
+        parent = merge_pairs(np.arange(w * h), a[close], b[close])
+        labels = get_labels(parent, (w, h))
+        order = np.arange(w * h).reshape(w, h)
+
+    if return_order:
+        return labels, order
+    return labels
+
+
+def label_sweep(matrix, tolerances):
+    """Labels of the neighbour grouping (label_shapes without seed_relative) at each tolerance in turn.
+
+    Yields (tolerance, labels). The shapes at a tolerance are unions of the
+    shapes at any smaller one, so the neighbour pairs are put in batches by
+    the smallest tolerance that joins them once, and merged a batch at a time
+    as the tolerance goes up (Kruskal style), rather than from scratch each time.
+    """
+
+    tolerances = list(tolerances)
+    steps = sorted(set(tolerances))
+    w, h = matrix.shape
+    a, b = get_neighbour_pairs(w, h)
+    # batch k holds the pairs first joined at steps[k] (len(steps) for never)
+    batch = np.searchsorted(steps, np.abs(matrix.ravel()[a] - matrix.ravel()[b]))
+    by_batch = np.argsort(batch.astype(np.uint16) if len(steps) < 1 << 16 else batch,
+                          kind='stable')   # a counting sort, for 16 bit keys
+    a, b = a[by_batch], b[by_batch]
+    ends = np.cumsum(np.bincount(batch, minlength=len(steps) + 1)).tolist()
+
+    parent = np.arange(w * h)
+    merged = 0
+    for tol in tolerances:
+        end = ends[steps.index(tol)]
+        if end < merged:
+            # the tolerance went down, start again
+            parent = np.arange(w * h)
+            merged = 0
+        merge_pairs(parent, a[merged:end], b[merged:end])
+        merged = end
+        yield tol, get_labels(parent, (w, h))